@@ -122,9 +122,11 @@ class Ack:
             redis_client=queue.redis_client,
         )
         self.need_ack = self.__queue.ack
+        self.native_ack = self.__queue.native_ack
 
         # Ack check if we need to ack the queue.
-        if self.need_ack:
+        # 存储自带ack机制时，不需要启动扫描线程
+        if self.need_ack and not self.native_ack:
             ack_check = AckCheck(
                 self.__ack_queue, self.__queue.ack_timeout, self.__queue
             )
@@ -139,7 +141,7 @@ class Ack:
         @return True if the message was added False if it was already in the queue ( no ack is needed for this
         """
         # If need_ack is set to true the ack is not required.
-        if not self.need_ack:
+        if not self.need_ack or self.native_ack:
             return
         message_data.start_time = int(datetime.now().timestamp())
         self.__ack_queue.no_ack_add(message_data.id_, json.dumps(message_data.__dict__))
@@ -156,18 +158,27 @@ class Ack:
         if not self.need_ack:
             return
         logger.info("[+]message {} is ack".format(message_data_id))
+        if self.native_ack:
+            self.__queue.ack_message(message_data_id)
+            return
         self.__ack_queue.ack(message_data_id)
 
     def no_ack(self, message_data: MessageData):
         """
-        Send a message without acknowledging it. This is useful for messages that have been acknowledged in the meantime.
-
-        @param message_data - The message to send. Must be a MessageData object
+        Give up a message whose retries are exhausted. The message is logged and acknowledged instead of being reposted, otherwise it would fail again at once and be reposted forever.
 
-        @return True if the message was sent
+        @param message_data - The message that failed. Must be a MessageData object
         """
         # If need_ack is set to true the ack is not required.
         if not self.need_ack:
             return
-        self.__queue.send_message(message_data)
+        # 重试次数已用完，记录消息后确认，不再重新投递
+        logger.error(
+            "[-]message {} failed after {} retries, dropped: {}".format(
+                message_data.id_, message_data.retry_count, json.dumps(message_data.__dict__)
+            )
+        )
+        if self.native_ack:
+            self.__queue.ack_message(message_data.id_)
+            return
         self.__ack_queue.ack(message_data.id_)
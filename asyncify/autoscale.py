@@ -0,0 +1,188 @@
+import itertools
+import math
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .consumer import Consumer
+from .logger import Logger
+from .queue_ import Queue
+
+logger = Logger(__name__)
+
+
+class Autoscaler:
+    def __init__(
+        self,
+        consumer: Consumer,
+        queue: Queue,
+        min_workers: int = 1,
+        max_workers: int = 4,
+        interval: float = 5,
+        cooldown: float = 30,
+        scale_up_latency: float = 10,
+        scale_down_latency: float = 2,
+        scale_down_samples: int = 3,
+        poll_timeout: float = 1,
+    ) -> None:
+        """
+        Initialize the autoscaler. Runs the consumer in between `min_workers` and `max_workers` threads, according to the queue depth and the recent processing time of messages.
+
+        @param consumer - 执行任务的 Consumer，会在多个 worker 线程中同时运行
+        @param queue - 采样队列长度的队列
+        @param min_workers - 最少 worker 数量
+        @param max_workers - 最多 worker 数量
+        @param interval - 采样间隔（s）
+        @param cooldown - 两次扩缩容之间的最短间隔（s）
+        @param scale_up_latency - 预计清空队列的时间超过该值（s）时扩容
+        @param scale_down_latency - 预计清空队列的时间低于该值（s）时缩容，应小于 scale_up_latency
+        @param scale_down_samples - 连续多少次采样都满足缩容条件才缩容
+        @param poll_timeout - worker 获取消息的最长阻塞时间（s），缩容时 worker 最晚在该时间后退出
+        """
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(f"invalid worker bounds: {min_workers},{max_workers}")
+        if scale_down_latency >= scale_up_latency:
+            raise ValueError("scale_down_latency should be lower than scale_up_latency")
+        self.consumer = consumer
+        self.queue = queue
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.cooldown = cooldown
+        self.scale_up_latency = scale_up_latency
+        self.scale_down_latency = scale_down_latency
+        self.scale_down_samples = scale_down_samples
+        self.poll_timeout = poll_timeout
+        self.__workers: List[Tuple[threading.Thread, threading.Event]] = []
+        self.__worker_ids = itertools.count()
+        self.__low_samples = 0
+        self.__last_scale = 0.0
+
+    @property
+    def worker_count(self) -> int:
+        """
+        Number of running workers, not counting the ones finishing their last message
+        """
+        return len(self.__workers)
+
+    def __start_worker(self):
+        stop_event = threading.Event()
+        t = threading.Thread(
+            target=self.consumer.serve,
+            args=(stop_event, self.poll_timeout),
+            name=f"asyncify-worker-{next(self.__worker_ids)}",
+            daemon=True,
+        )
+        t.start()
+        self.__workers.append((t, stop_event))
+
+    def __reap(self):
+        """
+        Forget workers whose thread died ( e.g. redis connection error while fetching ), so that they get replaced
+        """
+        alive = [(t, stop_event) for t, stop_event in self.__workers if t.is_alive()]
+        if len(alive) != len(self.__workers):
+            logger.error("[autoscale] {} workers died".format(len(self.__workers) - len(alive)))
+        self.__workers = alive
+
+    def __stop_worker(self) -> threading.Thread:
+        """
+        Ask the most recent worker to exit once its in-flight message is finished
+        """
+        t, stop_event = self.__workers.pop()
+        stop_event.set()
+        return t
+
+    def scale_to(self, count: int):
+        """
+        Start or stop workers to reach `count`, bounded by min_workers and max_workers
+
+        @param count - 目标 worker 数量
+        """
+        self.__reap()
+        count = max(self.min_workers, min(self.max_workers, count))
+        if count == self.worker_count:
+            return
+        logger.info("[autoscale] workers {} -> {}".format(self.worker_count, count))
+        while self.worker_count < count:
+            self.__start_worker()
+        while self.worker_count > count:
+            self.__stop_worker()
+        self.__last_scale = time.time()
+
+    def desired_workers(self, queue_size: int, avg_time: Optional[float]) -> int:
+        """
+        Compute the number of workers from a sample, with hysteresis between the scale up and scale down thresholds
+
+        @param queue_size - 当前队列长度
+        @param avg_time - 最近消息的平均处理时间（s），还没有处理过消息时为 None
+
+        @return The desired number of workers
+        """
+        workers = self.worker_count
+        if queue_size == 0:
+            drain_time = 0.0
+        elif avg_time is None:
+            # 还没有耗时数据时，有积压就扩容
+            drain_time = math.inf
+        else:
+            drain_time = queue_size * avg_time / workers
+
+        if drain_time > self.scale_up_latency:
+            self.__low_samples = 0
+            if avg_time is None:
+                return workers + 1
+            # 按比例扩容，使预计清空时间回到 scale_up_latency 以内
+            return max(workers + 1, math.ceil(queue_size * avg_time / self.scale_up_latency))
+        if drain_time < self.scale_down_latency:
+            self.__low_samples += 1
+            if self.__low_samples >= self.scale_down_samples:
+                self.__low_samples = 0
+                return workers - 1
+            return workers
+        self.__low_samples = 0
+        return workers
+
+    def sample(self):
+        """
+        Sample the queue depth and the processing time, then scale unless in cooldown.
+        Dead workers are replaced up to min_workers regardless of the cooldown
+        """
+        self.__reap()
+        if self.worker_count < self.min_workers:
+            self.scale_to(self.min_workers)
+        queue_size = self.queue.queue_size()
+        times = list(self.consumer.processing_times)
+        avg_time = sum(times) / len(times) if times else None
+        desired = max(self.min_workers, min(self.max_workers, self.desired_workers(queue_size, avg_time)))
+        logger.info(
+            "[autoscale] queue size: {}, avg time: {}, workers: {}, desired: {}".format(
+                queue_size,
+                "-" if avg_time is None else "{:.3f}s".format(avg_time),
+                self.worker_count,
+                desired,
+            )
+        )
+        if desired != self.worker_count and time.time() - self.__last_scale >= self.cooldown:
+            self.scale_to(desired)
+
+    def run(self):
+        """
+        Start min_workers workers and adjust them every `interval` seconds. On KeyboardInterrupt every worker finishes its in-flight message before returning
+        """
+        self.consumer.prepare()
+        self.scale_to(self.min_workers)
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.sample()
+                except Exception as e:
+                    # 采样失败（例如 redis 暂时不可用）时保持当前 worker 数量
+                    logger.error(f"[autoscale] sample failed: {e}")
+        except KeyboardInterrupt:
+            logger.info("[autoscale] stopping {} workers".format(self.worker_count))
+            stopping = [self.__stop_worker() for _ in range(self.worker_count)]
+            # 等待 worker 处理完当前消息，worker 退出 serve 时会写入还未写入的 trace span
+            for t in stopping:
+                t.join()
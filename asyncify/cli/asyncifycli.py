@@ -57,12 +57,66 @@ def queue_info(ctx):
         click.echo("[+]register task: {}".format(task_ident))
 
 @asyncify_cli.command()
+@click.option("--profile", is_flag=True, help="log fetch/decode/execute/ack timings of every message")
+@click.option("--profile-dir", default="asyncify-profile", help="directory of slow / sampled task profiles")
+@click.option("--slow-task-threshold", type=float, default=None, help="dump a profile of tasks slower than this (s)")
+@click.option("--profile-sample-rate", type=float, default=0.0, help="ratio of tasks profiled while sampling is on, toggled with SIGUSR1")
+@click.option("--trace-malloc", is_flag=True, help="also dump a tracemalloc snapshot of profiled tasks")
+@click.option("--trace-file", default=None, help="write a JSONL span of every message to this file")
+@click.option("--trace-stream", default=None, help="also batch the spans into this redis stream")
+@click.option("--trace-stream-maxlen", type=int, default=None, help="approximate max length of the trace stream ( MAXLEN ~ )")
+@click.option("--autoscale", default=None, help="min,max number of worker threads, scaled on queue depth and processing time")
+@click.option("--autoscale-interval", type=float, default=5, help="seconds between two samples of the queue")
+@click.option("--autoscale-cooldown", type=float, default=30, help="minimum seconds between two scaling decisions")
 @click.pass_context
-def consumer(ctx):
+def consumer(ctx, profile, profile_dir, slow_task_threshold, profile_sample_rate, trace_malloc, trace_file, trace_stream,
+             trace_stream_maxlen, autoscale, autoscale_interval, autoscale_cooldown):
     from asyncify.queue_ import Queue
     from asyncify.consumer import Consumer
+    from asyncify.profiler import TaskProfiler
+    from asyncify.tracing import Tracer
     queue_instance = cast(Queue, ctx.obj["queue_instance"])
-    consumer = Consumer(queue_instance)
+    profiler = None
+    if profile or slow_task_threshold is not None or profile_sample_rate:
+        profiler = TaskProfiler(
+            profile_dir=profile_dir,
+            slow_task_threshold=slow_task_threshold,
+            sample_rate=profile_sample_rate,
+            trace_malloc=trace_malloc,
+        )
+    tracer = None
+    if trace_stream and queue_instance.redis_client is None:
+        raise click.BadParameter(
+            "queue {} has no redis_client to write the stream to".format(queue_instance.__name__),
+            param_hint="--trace-stream",
+        )
+    if trace_file or trace_stream:
+        tracer = Tracer(
+            path=trace_file,
+            redis_client=queue_instance.redis_client if trace_stream else None,
+            stream_name=trace_stream or "asyncify-trace",
+            maxlen=trace_stream_maxlen,
+        )
+    consumer = Consumer(queue_instance, profiler=profiler, tracer=tracer)
+    if autoscale:
+        from asyncify.autoscale import Autoscaler
+        try:
+            min_workers, max_workers = [int(n) for n in autoscale.split(",")]
+        except ValueError:
+            raise click.BadParameter("expected min,max e.g. 1,8", param_hint="--autoscale")
+        try:
+            autoscaler = Autoscaler(
+                consumer,
+                queue_instance,
+                min_workers=min_workers,
+                max_workers=max_workers,
+                interval=autoscale_interval,
+                cooldown=autoscale_cooldown,
+            )
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="--autoscale")
+        autoscaler.run()
+        return
     consumer.run()
 
 
@@ -1,12 +1,18 @@
 import textwrap
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Callable
+from collections import deque
+from contextlib import nullcontext
+from typing import Callable, Optional
 
 from asyncify.message_data import MessageData
 
 from .ack import Ack
 from .logger import Logger
+from .profiler import TaskProfiler
 from .queue_ import Queue
+from .tracing import Tracer, current_message
 
 logger = Logger(__name__)
 
@@ -43,11 +49,18 @@ class Consumer(ConsumerBase, Ack):
     def __str__(self) -> str:
         return f"<consumer {id(self)}>"
 
-    def __init__(self, queue: Queue) -> None:
+    def __init__(
+        self,
+        queue: Queue,
+        profiler: Optional[TaskProfiler] = None,
+        tracer: Optional[Tracer] = None,
+    ) -> None:
         """
         Initialize the object. This is called by the : class : ` ~kombu. Queue ` when it is created.
 
         @param queue - The queue to use for this task. This must be a : class : ` kombu. Queue ` instance.
+        @param profiler - 可选的 TaskProfiler，开启后记录每条消息 fetch / decode / execute / ack 的耗时
+        @param tracer - 可选的 Tracer，开启后记录每条消息 enqueue / dequeue / start / end / ack 时间点
 
         @return The newly created queue or None if there was no queue associated with this task. : 0. 5 Added the __name__
         """
@@ -56,6 +69,10 @@ class Consumer(ConsumerBase, Ack):
         super().__init__(queue)
 
         self.__queue = queue
+        self.__profiler = profiler
+        self.__tracer = tracer
+        # 最近处理消息的耗时（s），用于自动扩缩容
+        self.processing_times = deque(maxlen=100)
         self.__name__ = self.__str__
         self.__repr__ = self.__str__
 
@@ -71,12 +88,21 @@ class Consumer(ConsumerBase, Ack):
         # entry逻辑会提前将消息加入到no_ack queue中，处理完成后，将会从队列中移除
         # 如果超时还未移出no_ack队列，则会重新将消息投入队列中，等待下次被消费
         # 如果需要ack确认机制，请将 queue.ack 设为 True
-        self.entry(message_data)
+        with self.__phase("ack"):
+            self.entry(message_data)
         args, kwargs = message_data.message
 
+        # 重试时保留第一次开始执行的时间
+        if self.__tracer:
+            self.__tracer.mark(message_data, "start", overwrite=False)
+        token = current_message.set(message_data)
         try:
             # 执行task
-            task_res = callable_func(*args, **kwargs)
+            with self.__phase("execute"):
+                if self.__profiler:
+                    task_res = self.__profiler.call(message_data, callable_func, *args, **kwargs)
+                else:
+                    task_res = callable_func(*args, **kwargs)
         except Exception as e:
             # 执行task失败后，进行重试
             # 
@@ -84,21 +110,43 @@ class Consumer(ConsumerBase, Ack):
                 message_data.retry_count += 1
                 return self.run_task(message_data, callable_func)
             logger.error(f"task executor error : {e}")
+            if self.__tracer:
+                self.__tracer.mark(message_data, "end", status="error")
             # If the queue is empty or not acked
             if self.__queue.ack:
-                self.no_ack(message_data)
+                with self.__phase("ack"):
+                    self.no_ack(message_data)
+            if self.__tracer:
+                self.__tracer.mark(message_data, "ack")
             return
+        finally:
+            current_message.reset(token)
+        if self.__tracer:
+            self.__tracer.mark(message_data, "end")
 
         logger.info(
             "message {} {} task result: {}".format(
                 str(message_data.id_), str(message_data.callable_func_ident), str(task_res)
             )
         )
-        self.ack(message_data.id_)
+        with self.__phase("ack"):
+            self.ack(message_data.id_)
+        if self.__tracer:
+            self.__tracer.mark(message_data, "ack")
 
-    def run(self):
+    def __phase(self, name: str):
         """
-        Main loop of the queue. Gets messages from the queue and dispatches them to the callable_func
+        Time a phase of the message handling when profiling is enabled
+
+        @param name - one of fetch, decode, execute, ack
+        """
+        if not self.__profiler:
+            return nullcontext()
+        return self.__profiler.phase(name)
+
+    def prepare(self):
+        """
+        Log the queue and its registered tasks, install the profiler signal handler. Called once before serving
         """
         echo_flag()
         logger.info("queue: {}".format(self.__queue.__name__))
@@ -110,14 +158,85 @@ class Consumer(ConsumerBase, Ack):
                 task_ident += "\n" * 3
             logger.info("[+]register task: {}".format(task_ident))
 
+        if self.__profiler:
+            self.__profiler.install_signal_handler()
+
+    def serve(self, stop_event: Optional[threading.Event] = None, poll_timeout: float = 1):
+        """
+        Gets messages from the queue and dispatches them to the callable_func until `stop_event` is set.
+        The message in flight is always finished before returning. Can be called from several threads
+
+        @param stop_event - 设置后处理完当前消息即退出，为 None 时一直运行
+        @param poll_timeout - 设置了 stop_event 时，每次获取消息的最长阻塞时间（s）
+        """
+        timeout = None if stop_event is None else poll_timeout
+        # 开启 trace 时，空闲期间也需要定期醒来写入积攒的 span
+        if timeout is None and self.__tracer:
+            timeout = self.__tracer.flush_interval
+        try:
+            self.__serve(stop_event, timeout)
+        finally:
+            # 退出前（包括 Ctrl-C）写入还未写入的 span
+            if self.__tracer:
+                self.__tracer.flush()
+
+    def __serve(self, stop_event: Optional[threading.Event], timeout: Optional[float]):
         # get all messages from the queue and run the callable function
-        while True:
-            message_data_dict = self.__queue.get_message()
+        while stop_event is None or not stop_event.is_set():
+            with self.__phase("fetch"):
+                item = self.__queue.get_raw_message(timeout)
+            if item is None:
+                # 空轮询的等待时间不计入下一条消息的 fetch 耗时
+                if self.__profiler:
+                    self.__profiler.discard()
+                if self.__tracer:
+                    self.__tracer.flush_if_due()
+                continue
+            try:
+                self.__handle(item)
+            except Exception as e:
+                # 无法处理的消息（无法反序列化、task 未注册、ack 失败等）记录后跳过，避免 worker 退出
+                logger.error("[-]skip message: {} {}".format(repr(e), str(item)[:200]))
+                # 存储自带ack机制时确认该消息，否则会在 ack_timeout 后被反复重新投递
+                try:
+                    self.__queue.discard_message(item)
+                except Exception as e:
+                    logger.error(f"[-]discard message error: {e}")
+                if self.__profiler:
+                    self.__profiler.discard()
+            logger.info("-" * 20)
+
+    def __handle(self, item):
+        """
+        Decode a message returned by `get_raw_message` and run its task
+        """
+        with self.__phase("decode"):
+            message_data_dict = self.__queue.decode_message(item)
             message_data = MessageData(**message_data_dict)
-            logger.info("[+]get message: {} {}".format(str(message_data.id_), str(message_data.callable_func_ident)))
+        if self.__tracer:
+            self.__tracer.mark(message_data, "dequeue")
+        logger.info("[+]get message: {} {}".format(str(message_data.id_), str(message_data.callable_func_ident)))
+        try:
             callable_func = self.__queue.callable_ident_map[
                 message_data_dict["callable_func_ident"]
             ]
             logger.info("[+]handle message: {}".format(str(message_data.id_), str(message_data.callable_func_ident)))
+            start = time.perf_counter()
             self.run_task(message_data, callable_func)
-            logger.info("-" * 20)
+            self.processing_times.append(time.perf_counter() - start)
+        except Exception:
+            if self.__tracer:
+                self.__tracer.mark(message_data, "end", status="error")
+            raise
+        finally:
+            if self.__profiler:
+                self.__profiler.report(message_data)
+            if self.__tracer:
+                self.__tracer.finish(message_data)
+
+    def run(self):
+        """
+        Main loop of the queue. Gets messages from the queue and dispatches them to the callable_func
+        """
+        self.prepare()
+        self.serve()
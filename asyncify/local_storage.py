@@ -0,0 +1,431 @@
+import atexit
+import inspect
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Iterable, List, Optional
+
+from .storage import StorageBase, _deadline
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+
+
+# python >= 3.13 可以关闭 resource_tracker，之前的版本会在进程退出时 unlink 所有用到的共享内存
+_SHM_TRACK_PARAM = "track" in inspect.signature(shared_memory.SharedMemory.__init__).parameters
+
+
+def _open_shm(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    """
+    Create or attach a shared memory block whose lifetime is managed by SharedMemoryStorage, not by the resource tracker
+    """
+    if _SHM_TRACK_PARAM:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def _unlink_shm(shm: shared_memory.SharedMemory):
+    """
+    Destroy a shared memory block opened with `_open_shm`
+    """
+    if not _SHM_TRACK_PARAM:
+        # unlink 会向 resource_tracker 取消注册，先注册回去保持一致
+        resource_tracker.register(shm._name, "shared_memory")
+    shm.unlink()
+
+
+class LocalStorage(StorageBase):
+    # 消息保存在进程内，ack 也在进程内完成
+    native_ack = True
+
+    def __init__(
+        self,
+        storage_name: str,
+        serialize_factory=json.dumps,
+        unserialize_factory=json.loads,
+        redis_client=None,
+        maxsize: int = 0,
+        ack_timeout: int = 30 * 60,
+        noack: bool = True,
+    ) -> None:
+        """
+        Initialize the in-process storage, for producers and consumers running as threads of the same process. Messages are passed as is, without serialization
+
+        @param storage_name - The name of the storage to use
+        @param serialize_factory - 未使用，消息不做序列化
+        @param unserialize_factory - 未使用，消息不做序列化
+        @param redis_client - 未使用
+        @param maxsize - 队列最大长度，队列满时 set 会阻塞，0 表示不限制
+        @param ack_timeout - 消息超过该时间（s）未确认将会被重新投递
+        @param noack - 不跟踪未确认的消息，用于不需要 ack 的队列
+        """
+        self.storage_name = storage_name
+        self.maxsize = maxsize
+        self.ack_timeout = ack_timeout
+        self.noack = noack
+        self.__messages = deque()
+        # 已取出但还未确认的消息 message_id -> (deadline, message)
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__not_empty = threading.Condition(self.__lock)
+        self.__not_full = threading.Condition(self.__lock)
+
+    @property
+    def size(self):
+        """
+        Returns the number of messages waiting in the queue
+
+        @return The number of messages in the queue
+        """
+        with self.__lock:
+            return len(self.__messages)
+
+    def __put(self, message: Any):
+        while self.maxsize and len(self.__messages) >= self.maxsize:
+            self.__not_full.wait()
+        self.__messages.appendleft(message)
+        self.__not_empty.notify()
+
+    def set(self, message: Any):
+        """
+        Put a message in the queue, blocking while the queue is full
+
+        @param message - The message to be sent
+
+        @return A tuple of HTTP status code and
+        """
+        with self.__lock:
+            self.__put(message)
+        return 200, "ok"
+
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Put several messages in the queue under a single lock acquisition
+
+        @param messages - The messages to be sent
+
+        @return A tuple of HTTP status code and
+        """
+        with self.__lock:
+            for message in messages:
+                self.__put(message)
+        return 200, "ok"
+
+    def __requeue_expired(self):
+        """
+        Put messages not acknowledged within `ack_timeout` back in the queue
+        """
+        now = time.time()
+        expired = [
+            (deadline, message_id)
+            for message_id, (deadline, _) in self.__pending.items()
+            if deadline <= now
+        ]
+        # 最早取出的消息放在最右侧，最先被重新消费
+        for _, message_id in sorted(expired, reverse=True):
+            _, message = self.__pending.pop(message_id)
+            self.__messages.append(message)
+
+    def get_raw(self, timeout: Optional[float] = None):
+        """
+        Pop a message from the queue. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The message or None on timeout
+        """
+        deadline = _deadline(timeout)
+        with self.__lock:
+            while True:
+                if not self.noack:
+                    self.__requeue_expired()
+                if self.__messages:
+                    break
+                # 需要 ack 时定期醒来检查超时未确认的消息
+                wait = None if self.noack else min(self.ack_timeout, 10)
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.__not_empty.wait(wait)
+            message = self.__messages.pop()
+            if not self.noack and isinstance(message, dict) and "id_" in message:
+                self.__pending[message["id_"]] = (time.time() + self.ack_timeout, message)
+            self.__not_full.notify()
+            return message
+
+    def decode(self, item: Any):
+        """
+        Messages are not serialized, returns the item itself
+
+        @param item - The message returned by `get_raw`
+
+        @return The message
+        """
+        return item
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get a message from the queue. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The message popped from the queue or None on timeout
+        """
+        return self.get_raw(timeout)
+
+    def ack(self, message_id: str):
+        """
+        Acknowledge a message, removing it from the pending messages
+
+        @param message_id - The id_ of the message
+        """
+        with self.__lock:
+            self.__pending.pop(message_id, None)
+
+    def discard(self, item: Any):
+        """
+        Acknowledge a message returned by `get_raw` that cannot be handled, so that it is not redelivered
+
+        @param item - The message returned by `get_raw`
+        """
+        if isinstance(item, dict) and "id_" in item:
+            self.ack(item["id_"])
+
+
+class SharedMemoryStorage(StorageBase):
+    # 头部: head, tail, count, capacity, slot_size, 引用计数
+    HEADER = struct.Struct("QQQQQQ")
+    # 每个槽位开头记录消息长度
+    LENGTH = struct.Struct("I")
+    # 等待消息或空槽位时的最长轮询间隔（s）
+    MAX_POLL_INTERVAL = 0.01
+
+    def __init__(
+        self,
+        storage_name: str,
+        serialize_factory=json.dumps,
+        unserialize_factory=json.loads,
+        redis_client=None,
+        capacity: int = 1024,
+        slot_size: int = 4096,
+    ) -> None:
+        """
+        Initialize the shared memory ring buffer, for producers and consumers running as co-located processes.
+        The segment is named after `storage_name`: the first process creates it, the others attach to it, and the last one to exit destroys it.
+        Processes synchronize through a flock on a lock file in the temp directory ( posix only ), and wait for messages by polling every few milliseconds at most
+
+        @param storage_name - The name of the storage to use
+        @param serialize_factory - A factory for serializing objects defaults to json. dumps
+        @param unserialize_factory - A factory for deserializing objects defaults to json. loads
+        @param redis_client - 未使用
+        @param capacity - 槽位数量，队列满时 set 会阻塞
+        @param slot_size - 每个槽位的字节数，序列化后超过该长度的消息无法放入
+        """
+        if fcntl is None:
+            raise RuntimeError("SharedMemoryStorage needs fcntl, it is only available on posix systems")
+        self.storage_name = storage_name
+        self.serialize_factory = serialize_factory
+        self.unserialize_factory = unserialize_factory
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.shm_name = "asyncify-" + re.sub(r"[^A-Za-z0-9_.-]", "_", storage_name)
+        self.__lock_path = os.path.join(tempfile.gettempdir(), self.shm_name + ".lock")
+        self.__thread_lock = threading.Lock()
+        self.__lock_file = None
+        self.__lock_pid = None
+        self.__closed = False
+
+        with self.__locked():
+            try:
+                self.__shm = _open_shm(
+                    self.shm_name, create=True, size=self.HEADER.size + capacity * slot_size
+                )
+                self.HEADER.pack_into(self.__shm.buf, 0, 0, 0, 0, capacity, slot_size, 1)
+            except FileExistsError:
+                self.__shm = _open_shm(self.shm_name)
+                head, tail, count, shm_capacity, shm_slot_size, refs = self.HEADER.unpack_from(self.__shm.buf, 0)
+                if (shm_capacity, shm_slot_size) != (capacity, slot_size):
+                    self.__shm.close()
+                    raise ValueError(
+                        f"shared memory {self.shm_name} has capacity={shm_capacity} slot_size={shm_slot_size}, "
+                        f"got capacity={capacity} slot_size={slot_size}"
+                    )
+                self.HEADER.pack_into(self.__shm.buf, 0, head, tail, count, capacity, slot_size, refs + 1)
+        # 进程退出时释放引用，最后一个进程销毁共享内存
+        self.__pid = os.getpid()
+        atexit.register(self.close)
+
+    @contextmanager
+    def __locked(self):
+        """
+        Lock the ring buffer against the other threads and processes
+        """
+        with self.__thread_lock:
+            # flock 作用于打开的文件，fork 出的子进程需要重新打开
+            if self.__lock_pid != os.getpid():
+                self.__lock_file = open(self.__lock_path, "a+")
+                self.__lock_pid = os.getpid()
+            fcntl.flock(self.__lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.__lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        Release the reference of this process to the shared memory, destroying it when no process uses it anymore.
+        Registered with atexit, calling it again does nothing
+        """
+        if self.__closed or os.getpid() != self.__pid:
+            return
+        self.__closed = True
+        with self.__locked():
+            fields = list(self.HEADER.unpack_from(self.__shm.buf, 0))
+            fields[5] -= 1
+            self.HEADER.pack_into(self.__shm.buf, 0, *fields)
+            self.__shm.close()
+            if fields[5] <= 0:
+                _unlink_shm(self.__shm)
+
+    @property
+    def size(self):
+        """
+        Returns the number of messages in the ring buffer
+
+        @return The number of messages in the queue
+        """
+        with self.__locked():
+            return self.HEADER.unpack_from(self.__shm.buf, 0)[2]
+
+    def __try_put(self, item: bytes) -> bool:
+        """
+        Write the item in the next free slot, the lock must be held
+
+        @return False if the ring buffer is full
+        """
+        head, tail, count, capacity, slot_size, refs = self.HEADER.unpack_from(self.__shm.buf, 0)
+        if count >= capacity:
+            return False
+        offset = self.HEADER.size + tail * slot_size
+        self.LENGTH.pack_into(self.__shm.buf, offset, len(item))
+        start = offset + self.LENGTH.size
+        self.__shm.buf[start:start + len(item)] = item
+        self.HEADER.pack_into(self.__shm.buf, 0, head, (tail + 1) % capacity, count + 1, capacity, slot_size, refs)
+        return True
+
+    def __try_pop(self) -> Optional[bytes]:
+        """
+        Read the item of the oldest slot, the lock must be held
+
+        @return None if the ring buffer is empty
+        """
+        head, tail, count, capacity, slot_size, refs = self.HEADER.unpack_from(self.__shm.buf, 0)
+        if count == 0:
+            return None
+        offset = self.HEADER.size + head * slot_size
+        (length,) = self.LENGTH.unpack_from(self.__shm.buf, offset)
+        start = offset + self.LENGTH.size
+        item = bytes(self.__shm.buf[start:start + length])
+        self.HEADER.pack_into(self.__shm.buf, 0, (head + 1) % capacity, tail, count - 1, capacity, slot_size, refs)
+        return item
+
+    def __put_all(self, items: List[bytes]):
+        """
+        Write the items in order, waiting for free slots while the ring buffer is full
+        """
+        for item in items:
+            if self.LENGTH.size + len(item) > self.slot_size:
+                raise ValueError(
+                    f"message of {len(item)} bytes does not fit in a slot of {self.slot_size} bytes"
+                )
+        pending = deque(items)
+        interval = 0.0005
+        while True:
+            with self.__locked():
+                while pending and self.__try_put(pending[0]):
+                    pending.popleft()
+            if not pending:
+                return
+            time.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def set(self, message: Any):
+        """
+        Put a message in the ring buffer, blocking while the buffer is full
+
+        @param message - The message to be sent. It must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        self.__put_all([self.serialize_factory(message).encode()])
+        return 200, "ok"
+
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Put several messages in the ring buffer, in order, with as few lock acquisitions as free slots allow
+
+        @param messages - The messages to be sent. They must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        self.__put_all([self.serialize_factory(message).encode() for message in messages])
+        return 200, "ok"
+
+    def get_raw(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Pop a message from the ring buffer without unserializing it. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The serialized message or None on timeout
+        """
+        deadline = _deadline(timeout)
+        interval = 0.0005
+        while True:
+            with self.__locked():
+                item = self.__try_pop()
+            if item is not None:
+                return item.decode()
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                time.sleep(min(interval, remaining))
+            else:
+                time.sleep(interval)
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def decode(self, item: str):
+        """
+        Unserialize a message returned by `get_raw`
+
+        @param item - The serialized message
+
+        @return The unserialized message
+        """
+        return self.unserialize_factory(item)
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get a message from the ring buffer. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The message popped from the ring buffer or None on timeout
+        """
+        item = self.get_raw(timeout)
+        return None if item is None else self.decode(item)
@@ -21,3 +21,10 @@ class MessageData:
     ack_timeout: int = 30 * 60
     # 消息开始时间
     start_time: Optional[int] = int(datetime.now().timestamp())
+
+    # trace id，同一调用链上的消息共享（根消息为自身id）
+    trace_id: Optional[str] = None
+    # 在 task 内部投递消息时，父消息id
+    parent_id: Optional[str] = None
+    # 投递时间
+    enqueue_time: Optional[float] = None
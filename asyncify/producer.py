@@ -2,12 +2,13 @@ import random
 from abc import ABC, abstractmethod
 from datetime import datetime
 from functools import partial
-from typing import Callable, Optional
+from typing import Callable, Iterable, Optional, Tuple
 
 from redis.exceptions import ConnectionError, RedisError
 
 from .message_data import MessageData
 from .queue_ import Queue
+from .tracing import current_message
 
 
 class ProducerBase(ABC):
@@ -83,28 +84,63 @@ class Producer(ProducerBase):
 
         callable_ident = self.__queue.__name__ + ":" + cls.__name__
         cls.delay = partial(self.delay, callable_ident=callable_ident)
+        cls.delay_many = partial(self.delay_many, callable_ident=callable_ident)
         self.__queue.callable_ident_map[callable_ident] = cls
         return cls
 
-    def delay(self, *args, callable_ident: str, **kwargs):
+    def __build_message(self, args: tuple, kwargs: dict, callable_ident: str) -> dict:
         """
-        Delay a call to a callable. This is useful for delaying an event that is triggered by a user - defined function such as a function of some sort.
+        Build the message dict of a call
 
-        @param callable_ident - Identifies the callable to call when the event is
+        @param args - positional arguments of the call
+        @param kwargs - keyword arguments of the call
+        @param callable_ident - Identifies the callable to call
+
+        @return The message dict
         """
         ack_timeout = self.ack_timeout or self.__queue.ack_timeout
         max_retry_count = self.max_retry_count or self.__queue.max_retry_count
-        
+
+        # 在 task 内部投递时，继承父消息的 trace id
+        id_ = id_factory()
+        parent = current_message.get()
         message_data = MessageData(
-            id_=id_factory(),
+            id_=id_,
             message=(args, kwargs),
             ack_timeout=ack_timeout,
             max_retry_count=max_retry_count,
             callable_func_ident=callable_ident,
+            trace_id=(parent.trace_id or parent.id_) if parent else id_,
+            parent_id=parent.id_ if parent else None,
+            enqueue_time=datetime.now().timestamp(),
         ).__dict__
+        return message_data
+
+    def delay(self, *args, callable_ident: str, **kwargs):
+        """
+        Delay a call to a callable. This is useful for delaying an event that is triggered by a user - defined function such as a function of some sort.
+
+        @param callable_ident - Identifies the callable to call when the event is
+        """
+        message_data = self.__build_message(args, kwargs, callable_ident)
 
         try:
             self.__queue.send_message(message_data)
         except RedisError as e:
             if isinstance(e, ConnectionError):
                 raise ConnectionError()
+
+    def delay_many(self, calls: Iterable[Tuple[tuple, dict]], callable_ident: str):
+        """
+        Delay several calls to a callable at once. Messages are sent in as few round trips as the queue storage allows ( e.g. pipelined per shard ).
+
+        @param calls - ( args, kwargs ) of every call
+        @param callable_ident - Identifies the callable to call when the event is
+        """
+        messages = [self.__build_message(args, kwargs, callable_ident) for args, kwargs in calls]
+
+        try:
+            self.__queue.send_messages(messages)
+        except RedisError as e:
+            if isinstance(e, ConnectionError):
+                raise ConnectionError()
@@ -0,0 +1,180 @@
+import cProfile
+import os
+import random
+import signal
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from .logger import Logger
+from .message_data import MessageData
+
+logger = Logger(__name__)
+
+# 耗时分段，按消息处理顺序输出
+PHASES = ("fetch", "decode", "execute", "ack")
+
+
+class TaskProfiler:
+    def __init__(
+        self,
+        profile_dir: str = "asyncify-profile",
+        slow_task_threshold: Optional[float] = None,
+        sample_rate: float = 0.0,
+        sampling: bool = False,
+        trace_malloc: bool = False,
+        toggle_signal: Optional[int] = getattr(signal, "SIGUSR1", None),
+    ) -> None:
+        """
+        Initialize the profiler. Records a fetch / decode / execute / ack timing breakdown for every message and dumps a profile of slow or sampled calls.
+
+        @param profile_dir - 慢任务 profile 文件输出目录
+        @param slow_task_threshold - 慢任务阈值（s），为 None 时不做慢任务采集
+        @param sample_rate - 采样开启时，每个任务被 profile 的概率 (0 ~ 1)
+        @param sampling - 启动时是否开启采样
+        @param trace_malloc - 是否同时记录 tracemalloc 内存快照
+        @param toggle_signal - 用于在运行中开关采样的信号，默认 SIGUSR1
+        """
+        self.profile_dir = profile_dir
+        self.slow_task_threshold = slow_task_threshold
+        self.sample_rate = sample_rate
+        self.sampling = sampling
+        self.trace_malloc = trace_malloc
+        self.toggle_signal = toggle_signal
+        self.__local = threading.local()
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        """
+        Timings of the message currently handled by this thread, in seconds.
+        """
+        if not hasattr(self.__local, "timings"):
+            self.__local.timings = {}
+        return self.__local.timings
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Measure a phase of the message handling. Durations of the same phase are accumulated ( e.g. execute on retry ).
+
+        @param name - one of fetch, decode, execute, ack
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings = self.timings
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self, message_data: MessageData):
+        """
+        Log the timing breakdown of the message and reset the timings of the current thread.
+
+        @param message_data - The message that was handled
+        """
+        timings = self.timings
+        self.__local.timings = {}
+        logger.info(
+            "[profile] message {} {} {}".format(
+                str(message_data.id_),
+                str(message_data.callable_func_ident),
+                " ".join(
+                    "{}={:.3f}ms".format(name, timings[name] * 1000)
+                    for name in PHASES
+                    if name in timings
+                ),
+            )
+        )
+
+    def discard(self):
+        """
+        Reset the timings of the current thread without logging them, e.g. after an empty poll or a skipped message.
+        """
+        self.__local.timings = {}
+
+    def install_signal_handler(self):
+        """
+        Toggle sampled profiling when `toggle_signal` is received. Only possible from the main thread
+        """
+        if self.toggle_signal is None:
+            return
+        try:
+            signal.signal(self.toggle_signal, self.__toggle_sampling)
+        except ValueError:
+            # 非主线程无法注册信号处理函数
+            logger.error("[profile] signal handler can only be installed in the main thread")
+            return
+        logger.info(
+            "[profile] send signal {} to pid {} to toggle sampled profiling".format(
+                str(self.toggle_signal), str(os.getpid())
+            )
+        )
+
+    def __toggle_sampling(self, signum, frame):
+        self.sampling = not self.sampling
+        logger.info("[profile] sampled profiling {}".format("on" if self.sampling else "off"))
+
+    def call(self, message_data: MessageData, callable_func: Callable, *args, **kwargs):
+        """
+        Run the task, under cProfile when it has to be profiled. The profile is dumped when the call was slow or sampled.
+
+        @param message_data - The message being executed
+        @param callable_func - The task to run
+
+        @return The task result
+        """
+        # 设置了慢任务阈值时每次调用都需要 profile，否则只 profile 被采样的调用
+        sampled = self.sampling and random.random() < self.sample_rate
+        if self.slow_task_threshold is None and not sampled:
+            return callable_func(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        trace_malloc = self.trace_malloc and not tracemalloc.is_tracing()
+        if trace_malloc:
+            tracemalloc.start()
+        try:
+            profile.enable()
+        except ValueError:
+            # 同一时刻只能有一个 profiler 生效（例如多线程 worker），本次不做 profile
+            if trace_malloc:
+                tracemalloc.stop()
+            return callable_func(*args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return callable_func(*args, **kwargs)
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot() if self.trace_malloc and tracemalloc.is_tracing() else None
+            if trace_malloc:
+                tracemalloc.stop()
+            slow = self.slow_task_threshold is not None and elapsed >= self.slow_task_threshold
+            if slow or sampled:
+                self.__dump(message_data, profile, snapshot, elapsed, "slow" if slow else "sample")
+
+    def __dump(self, message_data: MessageData, profile: cProfile.Profile, snapshot, elapsed: float, reason: str):
+        """
+        Write the profile ( and tracemalloc snapshot ) of a call to `profile_dir`
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        file_name = "{}-{}-{}".format(
+            reason,
+            str(message_data.callable_func_ident).replace(":", "_"),
+            str(message_data.id_),
+        )
+        profile_path = os.path.join(self.profile_dir, file_name + ".prof")
+        profile.dump_stats(profile_path)
+        if snapshot is not None:
+            snapshot.dump(os.path.join(self.profile_dir, file_name + ".tracemalloc"))
+        logger.info(
+            "[profile] {} task {} {} took {:.3f}s, profile saved to {}".format(
+                reason,
+                str(message_data.id_),
+                str(message_data.callable_func_ident),
+                elapsed,
+                profile_path,
+            )
+        )
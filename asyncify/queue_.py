@@ -1,8 +1,8 @@
 import json
 from abc import ABC, abstractmethod
-from typing import Any, Callable
+from typing import Any, Callable, Iterable, Optional, Type
 
-from .storage import Storage
+from .storage import ShardedStorage, Storage, StorageBase, redis_client_from
 
 
 class QueueBase(ABC):
@@ -27,12 +27,14 @@ class Queue(QueueBase):
     def __init__(
         self,
         name: str,
-        redis_client: Any,
+        redis_client: Any = None,
         ack: bool = False,
         max_retry_count: int = 3,
         ack_timeout: int = 30 * 60,
         serialize_factory: Callable = json.dumps,
         unserialize_factory: Callable = json.loads,
+        storage_class: Type[StorageBase] = Storage,
+        storage_options: Optional[dict] = None,
     ) -> None:
         """
         Initialize the storage with a name. 
@@ -44,8 +46,11 @@ class Queue(QueueBase):
         @param ack_timeout - 消息处理超时时间（s）
         @param serialize_factory - 序列化器
         @param unserialize_factory - 反序列化器
-        @param redis_client - redis客户端对象
+        @param redis_client - redis客户端对象或连接url，传入多个时消息将分片存储在多个redis节点上 ( ShardedStorage )
         @param max_retry_count - 最大重试次数
+        @param storage_class - 存储实现，默认为 redis list ( Storage )，可选 redis stream ( StreamStorage )、多节点分片 ( ShardedStorage )、
+                               不依赖 redis 的进程内队列 ( LocalStorage ) 或共享内存环形队列 ( SharedMemoryStorage )
+        @param storage_options - 传给 storage_class 的额外参数
         """
         # queue.__name__
         self.__name__ = name
@@ -56,40 +61,119 @@ class Queue(QueueBase):
         # queue.ack_timeout
         self.ack_timeout = ack_timeout
 
+        # 多个redis节点时默认使用分片存储，queue.redis_client 为第一个节点（用于ack等）
+        if isinstance(redis_client, (list, tuple)):
+            redis_client = [redis_client_from(client) for client in redis_client]
+            if storage_class is Storage:
+                storage_class = ShardedStorage
+            elif not issubclass(storage_class, ShardedStorage):
+                # 只有一个节点时直接使用该节点
+                if len(redis_client) != 1:
+                    raise ValueError(
+                        f"{storage_class.__name__} cannot shard across {len(redis_client)} redis clients"
+                    )
+                redis_client = redis_client[0]
+        else:
+            redis_client = redis_client_from(redis_client)
+
         # queue.redis_client
-        self.redis_client = redis_client
+        self.redis_client = redis_client[0] if isinstance(redis_client, list) else redis_client
 
         # queue.max_retry_count
         self.max_retry_count = max_retry_count
 
+        # 存储没有自带ack机制时，ack 依赖 redis
+        if ack and not storage_class.native_ack and self.redis_client is None:
+            raise ValueError(f"{storage_class.__name__} needs a redis_client to ack messages")
+
+        # 存储自带ack机制时（如 StreamStorage），由存储负责超时消息的重新投递
+        storage_options = dict(storage_options or {})
+        if storage_class.native_ack:
+            storage_options.setdefault("ack_timeout", ack_timeout)
+            storage_options.setdefault("noack", not ack)
+
         # queue.__storage object
-        self.__storage = Storage(
+        self.__storage = storage_class(
             storage_name=name,
             serialize_factory=serialize_factory,
             unserialize_factory=unserialize_factory,
             redis_client=redis_client,
+            **storage_options,
         )
 
         # 用于缓存注册在队列上task信息
         self.callable_ident_map = {}
 
+    @property
+    def native_ack(self) -> bool:
+        """
+        存储是否自带ack机制
+        Whether the storage acknowledges messages itself, in which case no AckCheck thread is needed.
+        """
+        return self.__storage.native_ack
+
+    def ack_message(self, message_id: str):
+        """
+        在存储中确认消息，仅 native_ack 为 True 时可用
+        Acknowledge a message in the storage.
+
+        @param message_id - The id_ of the message
+        """
+        if not self.native_ack:
+            raise ValueError(
+                f"{type(self.__storage).__name__} has no native ack, messages of queue {self.__name__} are acked through AckQueue"
+            )
+        self.__storage.ack(message_id)
+
+    def discard_message(self, item):
+        """
+        丢弃无法处理的消息（例如无法反序列化、task 未注册），存储自带ack机制时不会再重新投递
+        Drop a message returned by `get_raw_message` that cannot be handled.
+
+        @param item - The serialized message
+        """
+        self.__storage.discard(item)
+
     def queue_size(self) -> int:
         """
-        获取队列当前总长度
+        获取队列当前总长度（分片存储时为所有分片之和）
         Get the size of the queue. 
         This is used to determine how many items are in the queue for a given job.
         """
         return self.__storage.size
 
-    def get_message(self) -> dict:
+    def get_message(self, timeout: Optional[float] = None) -> Optional[dict]:
         """
         pop 队列中的消息，该方法是阻塞的
         Get the message from the storage. This is a low - level method that should be used by clients to get the message that is stored in the storage.
 
+        @param timeout - 阻塞等待的最长时间（s），超时返回 None，为 None 时一直阻塞
 
         @return The message that was stored in the storage or None if there was no message stored in the storage at
         """
-        return self.__storage.get()
+        return self.__storage.get(timeout)
+
+    def get_raw_message(self, timeout: Optional[float] = None):
+        """
+        pop 队列中未反序列化的消息，该方法是阻塞的
+        Get the message from the storage without unserializing it, see `decode_message`.
+
+        @param timeout - 阻塞等待的最长时间（s），超时返回 None，为 None 时一直阻塞
+
+        @return The serialized message or None on timeout
+        """
+        return self.__storage.get_raw(timeout)
+
+    def decode_message(self, item) -> dict:
+        """
+        反序列化 `get_raw_message` 获取的消息
+        Unserialize a message returned by `get_raw_message`.
+
+        @param item - The serialized message
+
+        @return The message dict
+        """
+        return self.__storage.decode(item)
 
     def send_message(self, message: Any):
         """
@@ -102,3 +186,13 @@ class Queue(QueueBase):
         """
         self.__storage.set(message)
         return
+
+    def send_messages(self, messages: Iterable[Any]):
+        """
+        批量将消息投放到队列中
+        Send several messages to the server in as few round trips as the storage allows.
+
+        @param messages - The messages to send. Must be serializable.
+        """
+        self.__storage.set_many(messages)
+        return
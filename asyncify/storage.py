@@ -1,11 +1,56 @@
+import itertools
 import json
+import os
+import socket
+import threading
+import time
+import zlib
 from abc import ABC, abstractmethod, abstractproperty
-from typing import Any
+from collections import deque
+from typing import Any, Callable, Iterable, List, Optional
 
 import redis
+from redis.exceptions import ResponseError
+
+
+def _to_str(value) -> str:
+    """
+    Decode a redis reply, the client may or may not be created with decode_responses
+    """
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def redis_client_from(redis_client):
+    """
+    Accept either a redis client or a connection url such as redis://host:6379/0
+
+    @param redis_client - redis client or url
+
+    @return The redis client
+    """
+    if isinstance(redis_client, str):
+        return redis.Redis.from_url(redis_client)
+    return redis_client
+
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    """
+    Absolute deadline of a blocking call, None blocks forever
+    """
+    return None if timeout is None else time.time() + timeout
+
+
+def _brpop_timeout(timeout: Optional[float]) -> float:
+    """
+    BRPOP timeout in seconds, None blocks forever. Redis truncates a timeout below 1ms to 0, which blocks forever, so it is raised to 1ms
+    """
+    return 0 if timeout is None else max(timeout, 0.001)
 
 
 class StorageBase(ABC):
+    # 存储本身是否支持消息确认（例如 redis stream 的 pending list），支持时不再需要 AckCheck 扫描线程
+    native_ack = False
+
     @abstractproperty
     def size(self):
         """
@@ -23,12 +68,58 @@ class StorageBase(ABC):
         ...
 
     @abstractmethod
-    def get(self):
+    def get(self, timeout: Optional[float] = None):
         """
         Get the value. This is a no - op if the value is not set. Returns result :
+
+        @param timeout - 阻塞等待的最长时间（s），超时返回 None，为 None 时一直阻塞
         """
         ...
 
+    @abstractmethod
+    def get_raw(self, timeout: Optional[float] = None):
+        """
+        Get the value without unserializing it. `get` is `decode(get_raw())`
+
+        @param timeout - 阻塞等待的最长时间（s），超时返回 None，为 None 时一直阻塞
+        """
+        ...
+
+    @abstractmethod
+    def decode(self, item: Any):
+        """
+        Unserialize a value returned by `get_raw`
+        """
+        ...
+
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Set several messages. Subclasses should override this to send them in as few round trips as possible
+
+        @param messages - The messages to set
+        """
+        for message in messages:
+            self.set(message)
+        return 200, "ok"
+
+    def ack(self, message_id: str):
+        """
+        Acknowledge a message returned by `get`. Storages with `native_ack` override this,
+        for the others messages are acknowledged through the redis AckQueue and this does nothing
+
+        @param message_id - The id_ of the message
+        """
+        return
+
+    def discard(self, item: Any):
+        """
+        Drop a message returned by `get_raw` that cannot be handled ( e.g. cannot be unserialized ), so that storages with `native_ack` do not redeliver it.
+        Does nothing for the others
+
+        @param item - The message returned by `get_raw`
+        """
+        return
+
 
 class Storage(StorageBase):
     def __init__(
@@ -36,7 +127,7 @@ class Storage(StorageBase):
         storage_name: str,
         serialize_factory=json.dumps,
         unserialize_factory=json.loads,
-        redis_client=redis.Redis(),
+        redis_client=None,
     ) -> None:
         """
         Initialize the class. This is the constructor for the Queue class. You can pass a factory for serializing and deserializing objects
@@ -48,7 +139,7 @@ class Storage(StorageBase):
 
         @return A reference to the Queue class for use in __init__ (... ) calls. Note that the serialization is done in a thread
         """
-        self.redis_client = redis_client
+        self.redis_client = redis_client if redis_client is not None else redis.Redis()
         self.serialize_factory = serialize_factory
         self.unserialize_factory = unserialize_factory
         self.__message_list_key = f"message-queue-{storage_name}"
@@ -71,15 +162,18 @@ class Storage(StorageBase):
         """
         self.redis_client.lpush(self.__message_list_key, item)
 
-    def __pop_list(self) -> str:
+    def __pop_list(self, timeout: Optional[float] = None) -> Optional[str]:
         """
         Pop and return the first item from the list. This is used to get the list of messages that have been sent to the server.
 
+        @param timeout - BRPOP timeout in seconds, None blocks forever
 
         @return The first item in the list or None if there are no items in the list ( no error is raised
         """
-        (_, item) = self.redis_client.brpop(self.__message_list_key, timeout=0)
-        return item.decode()
+        res = self.redis_client.brpop(self.__message_list_key, timeout=_brpop_timeout(timeout))
+        if not res:
+            return None
+        return res[1].decode()
 
     def set(self, message: Any):
         """
@@ -96,13 +190,502 @@ class Storage(StorageBase):
 
         return 200, "ok"
 
-    def get(self):
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Set several messages with a single LPUSH
+
+        @param messages - The messages to be sent. They must be serializable to JSON
+
+        @return A tuple of HTTP status code and
+        """
+        items = [self.serialize_factory(message) for message in messages]
+        if items:
+            self.redis_client.lpush(self.__message_list_key, *items)
+        return 200, "ok"
+
+    def get(self, timeout: Optional[float] = None):
         """
         Get a message from the queue. This is a blocking call. If there are no messages to return the queue is empty.
 
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
 
         @return The message that was popped from the queue or None if none was found. Note that it is possible that the queue is empty
         """
-        item = self.__pop_list()
-        message = self.unserialize_factory(item)
-        return message
+        item = self.get_raw(timeout)
+        return None if item is None else self.decode(item)
+
+    def get_raw(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Pop a message from the queue without unserializing it. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The serialized message or None on timeout
+        """
+        return self.__pop_list(timeout)
+
+    def decode(self, item: str):
+        """
+        Unserialize a message returned by `get_raw`
+
+        @param item - The serialized message
+
+        @return The unserialized message
+        """
+        return self.unserialize_factory(item)
+
+
+class ShardedStorage(StorageBase):
+    def __init__(
+        self,
+        storage_name: str,
+        serialize_factory=json.dumps,
+        unserialize_factory=json.loads,
+        redis_client=None,
+        shard_count: Optional[int] = None,
+        placement: str = "round_robin",
+        shard_key: Optional[Callable[[Any], str]] = None,
+        block: float = 0.2,
+    ) -> None:
+        """
+        Initialize the sharded storage. Messages are spread across `shard_count` lists, which are spread across the given redis clients
+
+        @param storage_name - The name of the storage to use
+        @param serialize_factory - A factory for serializing objects defaults to json. dumps
+        @param unserialize_factory - A factory for deserializing objects defaults to json. loads
+        @param redis_client - redis 客户端或连接 url 的列表
+        @param shard_count - 分片数量，默认每个 redis 节点一个分片
+        @param placement - 分片方式 round_robin 或 hash
+        @param shard_key - placement 为 hash 时，从消息中取出分片 key 的方法，默认使用消息 id_
+        @param block - 多个 redis 节点且所有分片都为空时，在其中一个节点上 BRPOP 的阻塞时间（s），其他节点上新到的消息最多延迟该时间被取到
+        """
+        if redis_client is None:
+            redis_client = [redis.Redis()]
+        if not isinstance(redis_client, (list, tuple)):
+            redis_client = [redis_client]
+        if placement not in ("round_robin", "hash"):
+            raise ValueError(f"unknown placement: {placement}")
+        self.redis_clients = [redis_client_from(client) for client in redis_client]
+        self.serialize_factory = serialize_factory
+        self.unserialize_factory = unserialize_factory
+        self.shard_count = shard_count or len(self.redis_clients)
+        self.placement = placement
+        self.shard_key = shard_key or (lambda message: message["id_"])
+        self.block = block
+        # 第 i 个分片 message-queue-<name>:<i> 放在第 i % n 个 redis 节点上
+        self.__shards = [
+            (self.redis_clients[i % len(self.redis_clients)], f"message-queue-{storage_name}:{i}")
+            for i in range(self.shard_count)
+        ]
+        # 每个 redis 节点上的分片 key
+        self.__nodes = [
+            (client, [key for shard_client, key in self.__shards if shard_client is client])
+            for client in self.redis_clients
+        ]
+        self.__nodes = [(client, keys) for client, keys in self.__nodes if keys]
+        self.__set_counter = itertools.count()
+        self.__get_counter = itertools.count()
+
+    def __place(self, message: Any) -> int:
+        """
+        Index of the shard the message is put in
+        """
+        if self.placement == "hash":
+            return zlib.crc32(str(self.shard_key(message)).encode()) % self.shard_count
+        return next(self.__set_counter) % self.shard_count
+
+    @property
+    def size(self):
+        """
+        Returns the number of messages in all shards, with one pipelined LLEN round trip per redis node
+
+        @return The number of messages in the queue
+        """
+        total = 0
+        for client, keys in self.__nodes:
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.llen(key)
+            total += sum(pipeline.execute())
+        return total
+
+    def set(self, message: Any):
+        """
+        Put a message in its shard
+
+        @param message - The message to be sent. It must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        client, key = self.__shards[self.__place(message)]
+        client.lpush(key, self.serialize_factory(message))
+        return 200, "ok"
+
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Put several messages in their shards, with one pipelined round trip per redis node
+
+        @param messages - The messages to be sent. They must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        shard_items = {}
+        for message in messages:
+            shard_items.setdefault(self.__place(message), []).append(self.serialize_factory(message))
+        pipelines = {}
+        for index, items in shard_items.items():
+            client, key = self.__shards[index]
+            if id(client) not in pipelines:
+                pipelines[id(client)] = client.pipeline(transaction=False)
+            pipelines[id(client)].lpush(key, *items)
+        for pipeline in pipelines.values():
+            pipeline.execute()
+        return 200, "ok"
+
+    def __pop_nonempty(self, client, keys: List[str]):
+        """
+        Pop one message from the first non-empty shard of a redis node without blocking.
+        The lengths of all shards are read in one pipelined round trip, so that at most one message is popped
+
+        @param client - The redis node
+        @param keys - The shard keys on this node, in polling order
+
+        @return The serialized message or None if all shards are empty
+        """
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.llen(key)
+        for key, length in zip(keys, pipeline.execute()):
+            if length:
+                # 可能已被其他消费者取走，继续检查下一个分片
+                item = client.rpop(key)
+                if item is not None:
+                    return item
+        return None
+
+    def get_raw(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Pop a message from the shards without unserializing it. This is a blocking call.
+        Every call starts from the next node and the next key so that all shards are polled fairly
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The serialized message or None on timeout
+        """
+        deadline = _deadline(timeout)
+        while True:
+            start = next(self.__get_counter)
+            nodes = [
+                (client, keys[start % len(keys):] + keys[:start % len(keys)])
+                for client, keys in self.__nodes[start % len(self.__nodes):] + self.__nodes[:start % len(self.__nodes)]
+            ]
+            # 只有一个节点时，直接对该节点的所有分片 BRPOP 一直阻塞等待
+            if len(nodes) == 1:
+                client, keys = nodes[0]
+                res = client.brpop(keys, timeout=_brpop_timeout(timeout))
+                return _to_str(res[1]) if res else None
+            # 多个节点时先不阻塞地检查所有分片（每个节点一次 pipeline 的 LLEN），只从非空分片 RPOP，
+            # 都为空再在其中一个节点上阻塞等待
+            for client, keys in nodes:
+                item = self.__pop_nonempty(client, keys)
+                if item is not None:
+                    return _to_str(item)
+            block = self.block
+            if deadline is not None:
+                block = min(block, deadline - time.time())
+                if block <= 0:
+                    return None
+            client, keys = nodes[0]
+            res = client.brpop(keys, timeout=_brpop_timeout(block))
+            if res:
+                return _to_str(res[1])
+
+    def decode(self, item: str):
+        """
+        Unserialize a message returned by `get_raw`
+
+        @param item - The serialized message
+
+        @return The unserialized message
+        """
+        return self.unserialize_factory(item)
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get a message from the shards. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The message popped from one of the shards or None on timeout
+        """
+        item = self.get_raw(timeout)
+        return None if item is None else self.decode(item)
+
+
+class StreamStorage(StorageBase):
+    native_ack = True
+
+    def __init__(
+        self,
+        storage_name: str,
+        serialize_factory=json.dumps,
+        unserialize_factory=json.loads,
+        redis_client=None,
+        group_name: str = "asyncify",
+        consumer_name: Optional[str] = None,
+        batch_size: int = 10,
+        block: float = 5,
+        maxlen: Optional[int] = None,
+        ack_timeout: int = 30 * 60,
+        claim_interval: float = 10,
+        noack: bool = False,
+    ) -> None:
+        """
+        Initialize the redis stream storage. Messages are read in batches through a consumer group, acknowledged with XACK and messages not acknowledged within `ack_timeout` are redelivered through XAUTOCLAIM.
+        A batch enters the pending list as soon as it is read, so a message waiting in the local buffer for more than half of `ack_timeout` has its idle time reset with XCLAIM before it is handed out,
+        and is skipped if another consumer has already claimed it
+
+        @param storage_name - The name of the storage to use
+        @param serialize_factory - A factory for serializing objects defaults to json. dumps
+        @param unserialize_factory - A factory for deserializing objects defaults to json. loads
+        @param redis_client - A redis client for communicating with the stream defaults to redis. Redis
+        @param group_name - 消费组名称
+        @param consumer_name - 消费者名称，默认为 hostname-pid
+        @param batch_size - 每次 XREADGROUP / XAUTOCLAIM 读取的消息数量
+        @param block - XREADGROUP 阻塞时间（s），超时后会检查是否有需要重新投递的消息
+        @param maxlen - stream 近似最大长度 ( MAXLEN ~ )，为 None 时不裁剪
+        @param ack_timeout - 消息超过该时间（s）未确认将会被重新投递
+        @param claim_interval - XAUTOCLAIM 检查间隔（s）
+        @param noack - 读取时不进入 pending list ( XREADGROUP NOACK )，用于不需要 ack 的队列
+        """
+        self.redis_client = redis_client if redis_client is not None else redis.Redis()
+        self.serialize_factory = serialize_factory
+        self.unserialize_factory = unserialize_factory
+        self.group_name = group_name
+        self.batch_size = batch_size
+        self.block = block
+        self.maxlen = maxlen
+        self.ack_timeout = ack_timeout
+        self.claim_interval = claim_interval
+        self.noack = noack
+        self.__consumer_name = consumer_name
+        self.__stream_key = f"message-stream-{storage_name}"
+        self.__group_created = False
+        # 本地缓存的批量读取结果 (entry_id, fields, 读取时间)
+        self.__buffer = deque()
+        # 已交给消费者但还未确认的消息 message_id -> (entry_id, data)
+        self.__pending = {}
+        self.__claim_cursor = "0-0"
+        self.__last_claim = 0.0
+        self.__lock = threading.Lock()
+
+    @property
+    def consumer_name(self) -> str:
+        """
+        Name of this consumer in the group. Computed on use so forked workers get their own name
+        """
+        return self.__consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+
+    def __ensure_group(self):
+        """
+        Create the stream and the consumer group on first use
+        """
+        if self.__group_created:
+            return
+        try:
+            self.redis_client.xgroup_create(self.__stream_key, self.group_name, id="0", mkstream=True)
+        except ResponseError as e:
+            # 消费组已存在
+            if "BUSYGROUP" not in str(e):
+                raise
+        self.__group_created = True
+
+    @property
+    def size(self):
+        """
+        Returns the number of messages not yet delivered to the group. Uses the group lag ( redis >= 7 ) and falls back to XLEN
+
+        @return The number of messages in the stream
+        """
+        self.__ensure_group()
+        for group in self.redis_client.xinfo_groups(self.__stream_key):
+            if _to_str(group["name"]) == self.group_name and group.get("lag") is not None:
+                return group["lag"]
+        return self.redis_client.xlen(self.__stream_key)
+
+    def set(self, message: Any):
+        """
+        Add a message to the stream with XADD, trimmed to `maxlen` when set
+
+        @param message - The message to be sent. It must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        self.__ensure_group()
+        self.__xadd(self.redis_client, message)
+        return 200, "ok"
+
+    def set_many(self, messages: Iterable[Any]):
+        """
+        Add several messages to the stream with one pipelined round trip
+
+        @param messages - The messages to be sent. They must be serializable
+
+        @return A tuple of HTTP status code and
+        """
+        self.__ensure_group()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for message in messages:
+            self.__xadd(pipeline, message)
+        pipeline.execute()
+        return 200, "ok"
+
+    def __xadd(self, client, message: Any):
+        """
+        XADD the message id and the serialized message, trimmed to `maxlen` when set
+        """
+        fields = {
+            "id": message.get("id_", "") if isinstance(message, dict) else "",
+            "data": self.serialize_factory(message),
+        }
+        if self.maxlen:
+            client.xadd(self.__stream_key, fields, maxlen=self.maxlen, approximate=True)
+        else:
+            client.xadd(self.__stream_key, fields)
+
+    def __claim(self):
+        """
+        Take over messages of the group that have not been acknowledged within `ack_timeout`
+
+        @return The claimed entries
+        """
+        res = self.redis_client.xautoclaim(
+            self.__stream_key,
+            self.group_name,
+            self.consumer_name,
+            min_idle_time=int(self.ack_timeout * 1000),
+            start_id=self.__claim_cursor,
+            count=self.batch_size,
+        )
+        self.__claim_cursor = res[0]
+        # 已被删除/裁剪的消息 fields 为空
+        now = time.time()
+        return [(entry_id, fields, now) for entry_id, fields in res[1] if fields]
+
+    def __refresh(self, entry_id, buffered: float) -> bool:
+        """
+        Reset the idle time of an entry that waited in the local buffer, unless it was claimed by another consumer meanwhile
+
+        @param entry_id - The stream entry id
+        @param buffered - Time in seconds the entry spent in the local buffer
+
+        @return True if the entry is still owned by this consumer
+        """
+        # 被其他消费者 XAUTOCLAIM 后空闲时间会被重置，小于 buffered 时 XCLAIM 不会返回该消息
+        claimed = self.redis_client.xclaim(
+            self.__stream_key,
+            self.group_name,
+            self.consumer_name,
+            min_idle_time=int(buffered * 1000),
+            message_ids=[entry_id],
+            justid=True,
+        )
+        return bool(claimed)
+
+    def __fill(self, block: float):
+        """
+        Fill the local buffer, redelivered messages first then new messages read with XREADGROUP COUNT n
+
+        @param block - XREADGROUP block time in seconds
+        """
+        if not self.noack and time.time() - self.__last_claim >= self.claim_interval:
+            self.__last_claim = time.time()
+            entries = self.__claim()
+            if entries:
+                self.__buffer.extend(entries)
+                return
+        res = self.redis_client.xreadgroup(
+            self.group_name,
+            self.consumer_name,
+            {self.__stream_key: ">"},
+            count=self.batch_size,
+            # BLOCK 0 表示一直阻塞，至少阻塞 1ms
+            block=max(int(block * 1000), 1),
+            noack=self.noack,
+        )
+        now = time.time()
+        for _, entries in res or []:
+            self.__buffer.extend((entry_id, fields, now) for entry_id, fields in entries)
+
+    def get_raw(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Get a message from the stream without unserializing it. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The serialized message or None on timeout
+        """
+        self.__ensure_group()
+        deadline = _deadline(timeout)
+        while True:
+            with self.__lock:
+                if not self.__buffer:
+                    block = self.block
+                    if deadline is not None:
+                        block = min(block, deadline - time.time())
+                        if block <= 0:
+                            return None
+                    self.__fill(block)
+                if not self.__buffer:
+                    continue
+                entry_id, fields, read_at = self.__buffer.popleft()
+            buffered = time.time() - read_at
+            if not self.noack and buffered >= self.ack_timeout / 2 and not self.__refresh(entry_id, buffered):
+                continue
+            fields = {_to_str(k): _to_str(v) for k, v in fields.items()}
+            if not self.noack:
+                self.__pending[fields["id"]] = (entry_id, fields["data"])
+            return fields["data"]
+
+    def decode(self, item: str):
+        """
+        Unserialize a message returned by `get_raw`
+
+        @param item - The serialized message
+
+        @return The unserialized message
+        """
+        return self.unserialize_factory(item)
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get a message from the stream. This is a blocking call.
+
+        @param timeout - 阻塞等待的最长时间（s），为 None 时一直阻塞
+
+        @return The message read from the stream or None on timeout
+        """
+        item = self.get_raw(timeout)
+        return None if item is None else self.decode(item)
+
+    def ack(self, message_id: str):
+        """
+        Acknowledge a message with XACK, removing it from the pending list of the group
+
+        @param message_id - The id_ of the message
+        """
+        pending = self.__pending.pop(message_id, None)
+        if pending is None:
+            return
+        self.redis_client.xack(self.__stream_key, self.group_name, pending[0])
+
+    def discard(self, item: str):
+        """
+        Acknowledge a message returned by `get_raw` that cannot be handled, so that XAUTOCLAIM does not redeliver it every `ack_timeout`
+
+        @param item - The serialized message
+        """
+        for message_id, (_, data) in list(self.__pending.items()):
+            if data == item:
+                self.ack(message_id)
+                return
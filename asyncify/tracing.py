@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from .logger import Logger
+from .message_data import MessageData
+
+logger = Logger(__name__)
+
+# 当前正在执行的消息，task 内部再次投递消息时用于传递 trace 上下文
+current_message: ContextVar[Optional[MessageData]] = ContextVar(
+    "asyncify_current_message", default=None
+)
+
+
+class Tracer:
+    def __init__(
+        self,
+        path: Optional[str] = "asyncify-trace.jsonl",
+        redis_client: Any = None,
+        stream_name: str = "asyncify-trace",
+        batch_size: int = 100,
+        flush_interval: float = 5,
+        maxlen: Optional[int] = None,
+    ) -> None:
+        """
+        Initialize the tracer. One span per message is written as a JSON line, and optionally batched into a redis stream.
+        The file is kept open and flushed together with the stream, at most every `flush_interval` seconds.
+
+        @param path - span 输出的 jsonl 文件，为 None 时不写文件
+        @param redis_client - 写入 redis stream 的客户端，为 None 时不写 stream
+        @param stream_name - redis stream 名称
+        @param batch_size - 每批写入 redis stream 的 span 数量
+        @param flush_interval - 距上次写入超过该时间（s）也会写入 redis stream 并刷新文件
+        @param maxlen - redis stream 近似最大长度 ( MAXLEN ~ )
+        """
+        self.path = path
+        self.redis_client = redis_client
+        self.stream_name = stream_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxlen = maxlen
+        self.__spans: Dict[str, dict] = {}
+        self.__batch: List[dict] = []
+        self.__file = None
+        self.__last_flush = time.time()
+        self.__lock = threading.Lock()
+
+    def mark(self, message_data: MessageData, event: str, overwrite: bool = True, **fields):
+        """
+        Record the timestamp of an event of the message.
+
+        @param message_data - The message
+        @param event - one of dequeue, start, end, ack
+        @param overwrite - whether a later mark of the same event ( e.g. on retry ) replaces the earlier one
+        @param fields - extra span fields, e.g. status
+        """
+        span = self.__spans.get(message_data.id_)
+        if span is None:
+            span = self.__spans[message_data.id_] = {
+                "trace_id": message_data.trace_id,
+                "message_id": message_data.id_,
+                "parent_id": message_data.parent_id,
+                "task": message_data.callable_func_ident,
+                "enqueue": message_data.enqueue_time,
+                "status": "ok",
+            }
+        if overwrite or event not in span:
+            span[event] = time.time()
+        span.update(fields)
+
+    def finish(self, message_data: MessageData):
+        """
+        Write the span of the message. Does nothing if the message was not marked
+
+        @param message_data - The message
+        """
+        span = self.__spans.pop(message_data.id_, None)
+        if span is None:
+            return
+        span["retry_count"] = message_data.retry_count
+        line = json.dumps(span)
+        with self.__lock:
+            if self.path:
+                if self.__file is None:
+                    self.__file = open(self.path, "a")
+                self.__file.write(line + "\n")
+            if self.redis_client is not None:
+                self.__batch.append(span)
+            if (
+                len(self.__batch) >= self.batch_size
+                or time.time() - self.__last_flush >= self.flush_interval
+            ):
+                self.__flush()
+
+    def flush(self):
+        """
+        Write the pending spans to the file and the redis stream
+        """
+        with self.__lock:
+            self.__flush()
+
+    def flush_if_due(self):
+        """
+        Write the pending spans to the file and the redis stream if `flush_interval` has elapsed since the last write, e.g. while the worker is idle
+        """
+        with self.__lock:
+            if time.time() - self.__last_flush >= self.flush_interval:
+                self.__flush()
+
+    def __flush(self):
+        batch, self.__batch = self.__batch, []
+        self.__last_flush = time.time()
+        if self.__file is not None:
+            self.__file.flush()
+        if not batch or self.redis_client is None:
+            return
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for span in batch:
+            fields = {k: "" if v is None else str(v) for k, v in span.items()}
+            if self.maxlen:
+                pipeline.xadd(self.stream_name, fields, maxlen=self.maxlen, approximate=True)
+            else:
+                pipeline.xadd(self.stream_name, fields)
+        try:
+            pipeline.execute()
+        except Exception as e:
+            # trace 写入失败不影响任务执行
+            logger.error(f"[trace] write {len(batch)} spans to stream {self.stream_name} failed: {e}")
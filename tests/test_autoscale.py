@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+
+from asyncify.autoscale import Autoscaler
+
+
+class FakeConsumer:
+    """
+    Workers wait until they are stopped, the first `failures` workers die at once
+    """
+
+    def __init__(self, failures=0):
+        self.processing_times = deque(maxlen=100)
+        self.failures = failures
+        self.closed = threading.Event()
+        self.__lock = threading.Lock()
+
+    def prepare(self):
+        pass
+
+    def serve(self, stop_event, poll_timeout):
+        with self.__lock:
+            fail = self.failures > 0
+            self.failures -= 1
+        if fail:
+            raise ConnectionError("redis down")
+        while not stop_event.is_set() and not self.closed.is_set():
+            stop_event.wait(poll_timeout)
+
+
+class FakeQueue:
+    def __init__(self, size=0):
+        self.size = size
+
+    def queue_size(self):
+        return self.size
+
+
+@pytest.fixture
+def consumer():
+    consumer = FakeConsumer()
+    yield consumer
+    consumer.closed.set()
+
+
+def autoscaler(consumer, queue, **kwargs):
+    kwargs.setdefault("min_workers", 1)
+    kwargs.setdefault("max_workers", 8)
+    kwargs.setdefault("cooldown", 0)
+    kwargs.setdefault("poll_timeout", 0.01)
+    return Autoscaler(consumer, queue, **kwargs)
+
+
+def test_scale_up_in_proportion_to_backlog(consumer):
+    queue = FakeQueue(size=50)
+    scaler = autoscaler(consumer, queue, scale_up_latency=10)
+    scaler.scale_to(1)
+    consumer.processing_times.extend([1.0] * 10)
+    # 50 条消息 * 1s / 10s = 5 个 worker
+    scaler.sample()
+    assert scaler.worker_count == 5
+    # 超过 max_workers 时取 max_workers
+    queue.size = 1000
+    scaler.sample()
+    assert scaler.worker_count == 8
+
+
+def test_scale_up_by_one_without_processing_times(consumer):
+    scaler = autoscaler(consumer, FakeQueue(size=1000))
+    scaler.scale_to(1)
+    scaler.sample()
+    assert scaler.worker_count == 2
+
+
+def test_scale_down_after_consecutive_low_samples(consumer):
+    queue = FakeQueue(size=0)
+    scaler = autoscaler(consumer, queue, scale_down_samples=3)
+    scaler.scale_to(3)
+    scaler.sample()
+    scaler.sample()
+    assert scaler.worker_count == 3
+    scaler.sample()
+    assert scaler.worker_count == 2
+    # 中间出现一次不满足缩容条件的采样时重新计数
+    scaler.sample()
+    queue.size = 10
+    consumer.processing_times.extend([1.0] * 10)
+    scaler.sample()
+    queue.size = 0
+    scaler.sample()
+    scaler.sample()
+    assert scaler.worker_count == 2
+    scaler.sample()
+    assert scaler.worker_count == 1
+
+
+def test_no_scaling_during_cooldown(consumer):
+    scaler = autoscaler(consumer, FakeQueue(size=1000), cooldown=60)
+    scaler.scale_to(1)
+    scaler.sample()
+    assert scaler.worker_count == 1
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_workers_replaced_up_to_min_workers(consumer):
+    consumer.failures = 2
+    scaler = autoscaler(consumer, FakeQueue(size=0), min_workers=3, cooldown=60)
+    scaler.scale_to(3)
+    time.sleep(0.1)
+    # 冷却期间也会补齐 min_workers
+    scaler.sample()
+    assert scaler.worker_count == 3
+    time.sleep(0.1)
+    alive = [t for t in threading.enumerate() if t.name.startswith("asyncify-worker") and t.is_alive()]
+    assert len(alive) == 3
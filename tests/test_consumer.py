@@ -0,0 +1,58 @@
+import threading
+
+from asyncify.consumer import Consumer
+from asyncify.local_storage import LocalStorage
+from asyncify.message_data import MessageData
+from asyncify.profiler import TaskProfiler
+from asyncify.queue_ import Queue
+
+
+def serve_for(consumer, seconds):
+    stop_event = threading.Event()
+    threading.Timer(seconds, stop_event.set).start()
+    consumer.serve(stop_event, poll_timeout=0.05)
+
+
+def test_failed_message_is_dropped_after_retries():
+    queue = Queue("test", storage_class=LocalStorage, ack=True, max_retry_count=1)
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise RuntimeError("fail")
+
+    queue.callable_ident_map["tests:fail"] = fail
+    consumer = Consumer(queue)
+    queue.send_message(
+        MessageData(id_="1", callable_func_ident="tests:fail", message=((), {}), max_retry_count=1).__dict__
+    )
+    serve_for(consumer, 0.3)
+    # 第一次执行 + 1 次重试，之后不再重新投递
+    assert len(calls) == 2
+    assert queue.queue_size() == 0
+
+
+def test_empty_polls_not_counted_in_fetch():
+    profiler = TaskProfiler(toggle_signal=None)
+    queue = Queue("test", storage_class=LocalStorage)
+    queue.callable_ident_map["tests:ok"] = lambda: None
+    consumer = Consumer(queue, profiler=profiler)
+    reported = []
+    report = profiler.report
+    profiler.report = lambda message_data: (reported.append(dict(profiler.timings)), report(message_data))
+    threading.Timer(
+        0.3,
+        queue.send_message,
+        args=(MessageData(id_="1", callable_func_ident="tests:ok", message=((), {})).__dict__,),
+    ).start()
+    serve_for(consumer, 0.5)
+    assert len(reported) == 1
+    assert reported[0]["fetch"] < 0.1
+
+
+def test_skipped_message_is_not_redelivered():
+    queue = Queue("test", storage_class=LocalStorage, ack=True, ack_timeout=0.1)
+    consumer = Consumer(queue)
+    queue.send_message(MessageData(id_="1", callable_func_ident="tests:missing", message=((), {})).__dict__)
+    serve_for(consumer, 0.2)
+    assert queue.get_message(timeout=0.3) is None
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+from asyncify.local_storage import LocalStorage, SharedMemoryStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def message(i):
+    return {"id_": str(i), "i": i}
+
+
+@pytest.fixture
+def shm_storage():
+    storage = SharedMemoryStorage(f"test-{uuid.uuid4().hex}", capacity=4, slot_size=128)
+    yield storage
+    storage.close()
+
+
+def test_local_get_timeout():
+    storage = LocalStorage("test")
+    start = time.time()
+    assert storage.get(timeout=0.2) is None
+    assert time.time() - start >= 0.2
+
+
+def test_local_blocking_get_woken_by_set():
+    storage = LocalStorage("test")
+    threading.Timer(0.1, storage.set, args=(message(1),)).start()
+    assert storage.get(timeout=2) == message(1)
+
+
+def test_local_set_many_order_and_size():
+    storage = LocalStorage("test")
+    storage.set(message(0))
+    storage.set_many([message(i) for i in range(1, 5)])
+    assert storage.size == 5
+    assert [storage.get()["i"] for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert storage.size == 0
+
+
+def test_local_ack_timeout_redelivery():
+    storage = LocalStorage("test", ack_timeout=0.2, noack=False)
+    storage.set_many([message(0), message(1)])
+    assert storage.get()["i"] == 0
+    assert storage.get()["i"] == 1
+    storage.ack("1")
+    # 未确认的消息超时后重新投递，已确认的不会
+    assert storage.get(timeout=1)["i"] == 0
+    storage.ack("0")
+    assert storage.get(timeout=0.4) is None
+
+
+def test_local_maxsize_blocks_set():
+    storage = LocalStorage("test", maxsize=1)
+    storage.set(message(0))
+    t = threading.Thread(target=storage.set, args=(message(1),))
+    t.start()
+    time.sleep(0.1)
+    assert t.is_alive()
+    assert storage.get()["i"] == 0
+    t.join(timeout=1)
+    assert not t.is_alive()
+    assert storage.size == 1
+
+
+def test_shm_get_timeout(shm_storage):
+    start = time.time()
+    assert shm_storage.get(timeout=0.2) is None
+    assert time.time() - start >= 0.2
+
+
+def test_shm_set_many_order_and_size(shm_storage):
+    shm_storage.set_many([message(i) for i in range(3)])
+    assert shm_storage.size == 3
+    assert [shm_storage.get()["i"] for _ in range(3)] == [0, 1, 2]
+    assert shm_storage.size == 0
+
+
+def test_shm_wraps_around_and_blocks_while_full(shm_storage):
+    # capacity 为 4，set_many 需要等待消费者腾出槽位
+    t = threading.Thread(target=shm_storage.set_many, args=([message(i) for i in range(10)],))
+    t.start()
+    assert [shm_storage.get(timeout=2)["i"] for _ in range(10)] == list(range(10))
+    t.join(timeout=2)
+    assert not t.is_alive()
+
+
+def test_shm_message_too_large(shm_storage):
+    with pytest.raises(ValueError):
+        shm_storage.set({"data": "x" * 1024})
+
+
+def test_shm_attach_checks_layout(shm_storage):
+    with pytest.raises(ValueError):
+        SharedMemoryStorage(shm_storage.storage_name, capacity=8, slot_size=128)
+
+
+def test_shm_shared_with_separately_started_process(shm_storage):
+    script = (
+        "from asyncify.local_storage import SharedMemoryStorage\n"
+        f"storage = SharedMemoryStorage({shm_storage.storage_name!r}, capacity=4, slot_size=128)\n"
+        "storage.set_many([{'i': i} for i in range(6)])\n"
+    )
+    producer = subprocess.Popen([sys.executable, "-c", script], cwd=ROOT)
+    assert [shm_storage.get(timeout=5)["i"] for _ in range(6)] == list(range(6))
+    assert producer.wait(timeout=5) == 0
+    # 生产者退出后共享内存仍然可用
+    shm_storage.set(message(7))
+    assert shm_storage.get(timeout=1)["i"] == 7
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm")
+def test_shm_destroyed_by_last_process():
+    storage = SharedMemoryStorage(f"test-{uuid.uuid4().hex}", capacity=4, slot_size=128)
+    other = SharedMemoryStorage(storage.storage_name, capacity=4, slot_size=128)
+    path = os.path.join("/dev/shm", storage.shm_name)
+    storage.close()
+    assert os.path.exists(path)
+    other.close()
+    assert not os.path.exists(path)
@@ -0,0 +1,165 @@
+import time
+
+import pytest
+
+from asyncify.storage import ShardedStorage, Storage, StreamStorage
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class RecordingRedis(fakeredis.FakeRedis):
+    """
+    Records the timeout of every BRPOP
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.brpop_timeouts = []
+
+    def brpop(self, keys, timeout=0):
+        self.brpop_timeouts.append(timeout)
+        return super().brpop(keys, timeout=timeout)
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def test_list_sub_millisecond_timeout_does_not_block_forever(server):
+    client = RecordingRedis(server=server)
+    storage = Storage("test", redis_client=client)
+    assert storage.get(timeout=0.0001) is None
+    assert client.brpop_timeouts == [0.001]
+
+
+def test_sharded_sub_millisecond_timeout_does_not_block_forever(server):
+    client = RecordingRedis(server=server)
+    storage = ShardedStorage("test", redis_client=[client], shard_count=2)
+    assert storage.get(timeout=0.0001) is None
+    assert client.brpop_timeouts == [0.001]
+
+
+def test_stream_discard_acks_entry(server):
+    client = fakeredis.FakeRedis(server=server)
+    storage = StreamStorage("test", redis_client=client, consumer_name="c1", block=0.01)
+    storage.set({"id_": "1"})
+    item = storage.get_raw(timeout=1)
+    assert client.xpending("message-stream-test", "asyncify")["pending"] == 1
+    storage.discard(item)
+    assert client.xpending("message-stream-test", "asyncify")["pending"] == 0
+
+
+def test_sharded_round_robin_placement_and_size():
+    clients = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(2)]
+    storage = ShardedStorage("test", redis_client=clients, shard_count=4)
+    storage.set_many([{"id_": str(i)} for i in range(8)])
+    # 每个分片 2 条，每个节点 2 个分片
+    assert [clients[i % 2].llen(f"message-queue-test:{i}") for i in range(4)] == [2, 2, 2, 2]
+    assert storage.size == 8
+    assert sorted(int(storage.get(timeout=1)["id_"]) for _ in range(8)) == list(range(8))
+    assert storage.size == 0
+    assert storage.get(timeout=0.01) is None
+
+
+def test_sharded_hash_placement():
+    clients = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(2)]
+    storage = ShardedStorage(
+        "test", redis_client=clients, shard_count=4, placement="hash", shard_key=lambda m: m["key"]
+    )
+    storage.set_many([{"id_": str(i), "key": "a"} for i in range(5)])
+    storage.set({"id_": "5", "key": "a"})
+    lengths = [clients[i % 2].llen(f"message-queue-test:{i}") for i in range(4)]
+    # 相同 key 的消息都在同一个分片上，并保持顺序
+    assert sorted(lengths) == [0, 0, 0, 6]
+    assert [storage.get(timeout=1)["id_"] for _ in range(6)] == [str(i) for i in range(6)]
+
+
+def test_sharded_multi_node_decode_responses():
+    clients = [fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True) for _ in range(2)]
+    storage = ShardedStorage("test", redis_client=clients)
+    storage.set_many([{"id_": "0"}, {"id_": "1"}])
+    assert sorted(storage.get(timeout=1)["id_"] for _ in range(2)) == ["0", "1"]
+
+
+def test_sharded_multi_node_sweep_pops_one_message():
+    clients = [fakeredis.FakeRedis(server=fakeredis.FakeServer()) for _ in range(2)]
+    storage = ShardedStorage("test", redis_client=clients, shard_count=4)
+    storage.set_many([{"id_": str(i)} for i in range(4)])
+    storage.get(timeout=1)
+    assert storage.size == 3
+
+
+def stream_storage(server, consumer_name, **kwargs):
+    kwargs.setdefault("block", 0.01)
+    return StreamStorage(
+        "test", redis_client=fakeredis.FakeRedis(server=server), consumer_name=consumer_name, **kwargs
+    )
+
+
+def pending(server):
+    return fakeredis.FakeRedis(server=server).xpending("message-stream-test", "asyncify")["pending"]
+
+
+def test_stream_batched_read_and_ack(server):
+    storage = stream_storage(server, "c1", batch_size=3)
+    storage.set_many([{"id_": str(i)} for i in range(5)])
+    assert storage.size == 5
+    assert storage.get(timeout=1)["id_"] == "0"
+    # 一次 XREADGROUP 读取 batch_size 条，都进入 pending list
+    assert pending(server) == 3
+    storage.ack("0")
+    assert pending(server) == 2
+    assert [storage.get(timeout=1)["id_"] for _ in range(4)] == ["1", "2", "3", "4"]
+    for i in range(1, 5):
+        storage.ack(str(i))
+    assert pending(server) == 0
+    assert storage.size == 0
+    assert storage.get(timeout=0.05) is None
+
+
+def test_stream_noack(server):
+    storage = stream_storage(server, "c1", noack=True)
+    storage.set({"id_": "0"})
+    assert storage.get(timeout=1)["id_"] == "0"
+    assert pending(server) == 0
+
+
+def test_stream_unacked_message_redelivered(server):
+    first = stream_storage(server, "c1", ack_timeout=0.1, claim_interval=0)
+    second = stream_storage(server, "c2", ack_timeout=0.1, claim_interval=0)
+    first.set_many([{"id_": "0"}, {"id_": "1"}])
+    assert [first.get(timeout=1)["id_"] for _ in range(2)] == ["0", "1"]
+    first.ack("1")
+    assert second.get(timeout=0.05) is None
+    time.sleep(0.15)
+    # 超过 ack_timeout 未确认的消息由其他消费者 XAUTOCLAIM 重新投递
+    assert second.get(timeout=1)["id_"] == "0"
+    second.ack("0")
+    assert pending(server) == 0
+
+
+def test_stream_buffered_entry_refreshed(server):
+    storage = stream_storage(server, "c1", batch_size=2, ack_timeout=0.2, claim_interval=60)
+    storage.set_many([{"id_": "0"}, {"id_": "1"}])
+    assert storage.get(timeout=1)["id_"] == "0"
+    time.sleep(0.15)
+    # 在本地缓存中等待超过 ack_timeout / 2 的消息交出前会重置空闲时间
+    assert storage.get(timeout=1)["id_"] == "1"
+    entries = fakeredis.FakeRedis(server=server).xpending_range(
+        "message-stream-test", "asyncify", min="-", max="+", count=10
+    )
+    idle = {entry["message_id"]: entry["time_since_delivered"] for entry in entries}
+    assert len(idle) == 2
+    assert min(idle.values()) < 100
+
+
+def test_stream_buffered_entry_claimed_by_other_consumer_skipped(server):
+    first = stream_storage(server, "c1", batch_size=2, ack_timeout=0.2, claim_interval=60)
+    second = stream_storage(server, "c2", batch_size=2, ack_timeout=0.2, claim_interval=0)
+    first.set_many([{"id_": "0"}, {"id_": "1"}])
+    assert first.get(timeout=1)["id_"] == "0"
+    time.sleep(0.25)
+    # 其他消费者已经接管了缓存中的消息，不会再交出
+    assert sorted(second.get(timeout=1)["id_"] for _ in range(2)) == ["0", "1"]
+    assert first.get(timeout=0.05) is None
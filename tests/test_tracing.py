@@ -0,0 +1,36 @@
+import json
+
+from asyncify.message_data import MessageData
+from asyncify.tracing import Tracer
+
+
+def message(i):
+    return MessageData(id_=str(i), callable_func_ident="tests:task", message=((), {}))
+
+
+def read_spans(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_written_to_file_on_flush(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer(path=str(path), flush_interval=60)
+    for i in range(3):
+        tracer.mark(message(i), "dequeue")
+        tracer.finish(message(i))
+    tracer.flush()
+    assert [span["message_id"] for span in read_spans(path)] == ["0", "1", "2"]
+
+
+def test_spans_written_to_file_when_due(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer(path=str(path), flush_interval=0)
+    tracer.mark(message(0), "dequeue")
+    tracer.mark(message(0), "end", status="error")
+    tracer.finish(message(0))
+    tracer.flush_if_due()
+    spans = read_spans(path)
+    assert len(spans) == 1
+    assert spans[0]["status"] == "error"
+    assert spans[0]["end"] >= spans[0]["dequeue"]